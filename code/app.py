@@ -4,14 +4,41 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from flask import Flask
-import json
+import math
 from flask import request, jsonify, after_this_request
 from run_query import run_query, get_covid_count
 from run_query_arbitrary import run_query_arbitrary
 from update import main as update
+from query_engine import engine
+import registry, warmup
 
 app = app = Flask(__name__)
 
+warmup.start()
+
+def check_coords(lat, lon):
+    '''
+    Makes sure that the coordinates are a latitude
+    and a longitude, before they reach the caches
+    '''
+
+    lat, lon = float(lat), float(lon)
+
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        raise ValueError("ERRO FATAL: as coordenadas devem ser números finitos.")
+
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("ERRO FATAL: as coordenadas estão fora dos limites de latitude e longitude.")
+
+def check_deaths(deaths):
+    '''
+    Makes sure that the number of deaths
+    is a number greater than zero
+    '''
+
+    if not float(deaths) > 0:
+        raise ValueError("ERRO FATAL: o número de mortes deve ser maior que zero.")
+
 @app.route("/", methods=['GET'])
 def answer_basic():
     return jsonify("hi! Up and running!")
@@ -25,9 +52,18 @@ def answer():
         
     lat = str(request.args['lat'])
     lon = str(request.args['lon'])
+    solver = str(request.args.get('solver', 'profile'))
+
+    # Malformed input is refused as a bad request. Points that the query can't answer keep the usual error
+    try:
+        check_coords(lat, lon)
+
+    except ValueError:
+        return {"error":1}, 400
 
     try:
-        out = run_query([lat, lon])
+        tolerance = float(request.args.get('tolerance', .1))
+        out = run_query([lat, lon], solver=solver, tolerance=tolerance)
 
     except ValueError as e:
         return {"error":1}
@@ -44,9 +80,18 @@ def answer_arbitrary():
     lat = str(request.args['lat'])
     lon = str(request.args['lon'])
     deaths = str(request.args['deaths'])
+    solver = str(request.args.get('solver', 'profile'))
 
     try:
-        out = run_query_arbitrary([lat, lon, deaths])
+        check_coords(lat, lon)
+        check_deaths(deaths)
+
+    except ValueError:
+        return {"error":1}, 400
+
+    try:
+        tolerance = float(request.args.get('tolerance', .1))
+        out = run_query_arbitrary([lat, lon, deaths], solver=solver, tolerance=tolerance)
 
     except ValueError as e:
         return {"error":1}
@@ -71,17 +116,36 @@ def handle_count():
         response.headers['Access-Control-Allow-Origin'] = '*'
         return response
 
-    with open("/app/output/case_count.json") as file:
-
-        data = json.load(file)
+    data = registry.case_count()
 
-        output = {
-            "deaths": data['deaths'],
-            "date": data['time'],
-            "vanishing_cities": data['vanishing_cities']
-            }
+    output = {
+        "deaths": data['deaths'],
+        "date": data['time'],
+        "vanishing_cities": data['vanishing_cities']
+        }
 
     return jsonify(output)
 
+@app.route("/ready", methods=['GET'])
+def handle_ready():
+    '''
+    Only reports that the worker is ready
+    once the reference data is loaded
+    '''
+
+    if not warmup.state["ready"]:
+        return jsonify({ "ready": False, "error": warmup.state["error"], "attempts": warmup.state["attempts"] }), 503
+
+    return jsonify({ "ready": True })
+
+@app.route("/stats", methods=['GET'])
+def handle_stats():
+    '''
+    Reports how the caches of this
+    worker are doing
+    '''
+
+    return jsonify(engine.stats())
+
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+In this script, we build the indexes used to find cities
+around the user. They are built once from the files saved by
+prepare_city_info.py, kept by the registry and shared by
+every request
+'''
+
+import geopandas as gpd
+import numpy as np
+import json, shapely
+
+########################
+### VANISHING CITIES ###
+########################
+
+def build_vanishing_index(cities_info):
+    '''
+    Sorts the cities by population, so that the ones that
+    would vanish under any target come first, and splits
+    the sorted list in blocks of 1, 2, 4... cities, each
+    with its own STRtree. Any set of first cities is the
+    union of at most one block of each size
+    '''
+
+    population = cities_info.pop_2019.values
+
+    order = np.argsort(population, kind='stable')
+
+    points = np.asarray(cities_info.geometry.values)[order]
+
+    levels = [ ]
+
+    size = 1
+
+    while size <= len(order):
+
+        levels.append([ shapely.STRtree(points[start:start + size]) for start in range(0, len(order) - size + 1, size) ])
+
+        size *= 2
+
+    return {
+
+        "order": order,
+        "population": population[order],
+        "levels": levels
+
+    }
+
+def read_vanishing_index(fpath):
+
+    return build_vanishing_index(gpd.read_feather(fpath, columns=["pop_2019", "geometry"]))
+
+def nearest_vanishing_city(index, point, target):
+    '''
+    Returns the row of city_info.feather holding the city
+    nearest to the point among those with no more people
+    than the target, or -1 if there is none. Only one tree
+    of each size is searched
+    '''
+
+    count = np.searchsorted(index["population"], target, side='right')
+
+    best, best_distance = -1, np.inf
+
+    start = 0
+
+    for depth in range(len(index["levels"]) - 1, -1, -1):
+
+        size = 2 ** depth
+
+        if not count & size:
+            continue
+
+        found, distance = index["levels"][depth][start // size].query_nearest(point, return_distance=True)
+
+        if distance[0] < best_distance:
+
+            best, best_distance = start + found[0], distance[0]
+
+        start += size
+
+    return index["order"][best] if best >= 0 else -1
+
+################
+### CAPITALS ###
+################
+
+def read_capitals(fpath):
+    '''
+    Reads the capitals saved by prepare_capitals_radius.py,
+    along with their centroids as a plain array. Files saved
+    before the centroids were stored fall back to the point
+    used to compute the radius of each capital
+    '''
+
+    with open(fpath) as file:
+
+        choices = json.load(file)
+
+    coords = [ capital["centroid"] if "centroid" in capital else [ float(capital["input_point"][1]), float(capital["input_point"][0]) ] for capital in choices ]
+
+    return {
+
+        "choices": choices,
+        "code_muni": np.array([ capital["code_muni"] for capital in choices ]),
+        "coords": np.array(coords, dtype=float)
+
+    }
+
+def nearest_capital(capitals, point, excluded):
+    '''
+    Returns the capital nearest to the point, other
+    than the city with the excluded code
+    '''
+
+    coords = capitals["coords"]
+
+    distance = np.hypot(coords[:, 0] - point.x, coords[:, 1] - point.y)
+
+    distance[ capitals["code_muni"] == excluded ] = np.inf
+
+    return capitals["choices"][ int(np.argmin(distance)) ]
+
+###############
+### LOCATOR ###
+###############
+
+def build_city_locator(outlines, tolerance):
+    '''
+    Keeps, for each city, its outline along with two simple
+    shapes: one that surely lies inside of it and one that
+    surely covers it. Simplifying moves the border by at
+    most the tolerance, so shrinking or growing the outline
+    by twice as much first keeps it on the right side. Also
+    keeps the centroids, for points that fall in no city
+    '''
+
+    geometries = shapely.buffer(np.asarray(outlines.geometry.values), 0)
+
+    inner = shapely.simplify(shapely.buffer(geometries, -2 * tolerance), tolerance)
+
+    outer = shapely.simplify(shapely.buffer(geometries, 2 * tolerance), tolerance)
+
+    return gpd.GeoDataFrame({
+
+        "code_muni": outlines.code_muni.values,
+        "inner": gpd.GeoSeries(inner, crs=outlines.crs),
+        "outer": gpd.GeoSeries(outer, crs=outlines.crs),
+        "centroid": gpd.GeoSeries(shapely.centroid(geometries), crs=outlines.crs)
+
+    }, geometry=gpd.GeoSeries(geometries, crs=outlines.crs))
+
+def read_city_locator(fpath):
+    '''
+    Loads the locator saved by prepare_city_info.py and
+    indexes it. Its rows follow those of city_info.feather
+    '''
+
+    locator = gpd.read_feather(fpath)
+
+    shapes = { name: np.asarray(locator[name].values) for name in ("geometry", "inner", "outer", "centroid") }
+
+    for name in ("geometry", "inner", "outer"):
+
+        shapely.prepare(shapes[name])
+
+    return dict(shapes,
+
+        code_muni=locator.code_muni.values,
+        tree=shapely.STRtree(shapes["outer"]),
+        centroid_tree=shapely.STRtree(shapes["centroid"])
+
+    )
+
+def locate_city(locator, point):
+    '''
+    Returns the row of city_info.feather holding the city
+    that contains the point. Only points near a border are
+    tested against the full outline. Not all points within
+    Brazil are covered by the outlines, as happens on the
+    coast of Rio de Janeiro, so the others get the city with
+    the nearest centroid
+    '''
+
+    candidates = locator["tree"].query(point)
+
+    inside = candidates[ shapely.contains(locator["inner"][candidates], point) ]
+
+    if len(inside) == 0:
+
+        near_border = candidates[ shapely.contains(locator["outer"][candidates], point) ]
+
+        inside = near_border[ shapely.contains(locator["geometry"][near_border], point) ]
+
+    if len(inside) > 0:
+
+        return int(inside[0])
+
+    return int(locator["centroid_tree"].nearest(point))
@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+In this script, we compute how much of each census tract
+falls inside a circle using only NumPy. The outline of every
+tract is stored as flat arrays of oriented rings, which are
+broken into edges when they are loaded: each edge,
+together with the center of the circle, forms a triangle, and
+the area of a triangle that lies inside a circle centered on one
+of its vertices has a closed formula. Summing those signed areas
+over the outline of a tract gives exactly the area of the tract
+inside the circle, with no buffer polygon and no GEOS calls
+'''
+
+from parallel import map_chunks
+import numpy as np
+import settings, shapely
+
+# How many tracts, in Hilbert order, share a node of the packed index
+NODE_SIZE = 16
+
+# How to reduce each column of the bounds: minx, miny, maxx, maxy
+BOUNDS = [ (np.minimum.reduceat, 0), (np.minimum.reduceat, 1), (np.maximum.reduceat, 2), (np.maximum.reduceat, 3) ]
+
+###############
+### PREPARE ###
+###############
+
+def tract_rings(geometries):
+    '''
+    Breaks the tracts into the coordinates of their rings,
+    with exteriors running counterclockwise and holes
+    clockwise. Returns the coordinates along with where the
+    coordinates of each ring, the rings of each polygon and
+    the polygons of each tract start
+    '''
+
+    geometries = np.asarray(geometries, dtype=object)
+
+    parts, tract = shapely.get_parts(geometries, return_index=True)
+
+    # Clipping the tracts may leave nested collections behind
+    while True:
+
+        multi = shapely.get_type_id(parts) >= 4
+
+        if not multi.any():
+            break
+
+        nested, nested_index = shapely.get_parts(parts[multi], return_index=True)
+
+        parts = np.concatenate([ parts[~multi], nested ])
+
+        tract = np.concatenate([ tract[~multi], tract[multi][nested_index] ])
+
+    # Only polygons have area. Lines and points left by the clipping are dropped
+    polygons = (shapely.get_type_id(parts) == 3) & (shapely.area(parts) > 0)
+
+    parts, tract = parts[polygons], tract[polygons]
+
+    order = np.argsort(tract, kind='stable')
+
+    parts, tract = parts[order], tract[order]
+
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+
+    is_exterior = np.ones(len(rings), dtype=bool)
+
+    is_exterior[1:] = ring_part[1:] != ring_part[:-1]
+
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+
+    ring_offsets = np.concatenate([ [0], np.cumsum(np.bincount(coord_ring, minlength=len(rings))) ])
+
+    # Rings are closed, so consecutive coordinates of the same ring form an edge
+    same_ring = coord_ring[:-1] == coord_ring[1:]
+
+    cross = (coords[:-1, 0] * coords[1:, 1] - coords[:-1, 1] * coords[1:, 0])[same_ring]
+
+    ring_area = np.bincount(coord_ring[:-1][same_ring], weights=cross, minlength=len(rings))
+
+    # Flips the rings that run the wrong way, reading their coordinates backwards
+    flip = (ring_area > 0) != is_exterior
+
+    start, end = ring_offsets[coord_ring], ring_offsets[coord_ring + 1]
+
+    position = np.arange(len(coords))
+
+    coords = coords[ np.where(flip[coord_ring], start + end - 1 - position, position) ]
+
+    return {
+
+        "coords": coords,
+        "ring_offsets": ring_offsets,
+        "part_offsets": np.concatenate([ [0], np.cumsum(np.bincount(ring_part, minlength=len(parts))) ]),
+        "tract_offsets": np.concatenate([ [0], np.cumsum(np.bincount(tract, minlength=len(geometries))) ])
+
+    }
+
+def ring_edges(rings):
+    '''
+    Turns the rings found by tract_rings into edges, as rows
+    of x0, y0, x1, y1, and finds where the edges of each tract
+    start. A ring of n coordinates has n - 1 edges, so this
+    is only a matter of pairing consecutive coordinates
+    '''
+
+    coords, ring_offsets = rings["coords"], np.asarray(rings["ring_offsets"], dtype=int)
+
+    if len(coords) == 0:
+
+        edges = np.empty((0, 4))
+
+    else:
+
+        # The last coordinate of a ring doesn't start an edge
+        starts = np.ones(len(coords) - 1, dtype=bool)
+
+        starts[ring_offsets[1:-1] - 1] = False
+
+        edges = np.hstack([ coords[:-1], coords[1:] ])[starts]
+
+    edge_offsets = ring_offsets - np.arange(len(ring_offsets))
+
+    offsets = edge_offsets[ np.asarray(rings["part_offsets"])[ np.asarray(rings["tract_offsets"]) ] ]
+
+    return edges, offsets
+
+def hilbert_distances(bounds, total_bounds, level=16):
+    '''
+    Finds how far along a Hilbert curve that fills the
+    total bounds the center of each box lies. The curve
+    visits 2 ** level cells on each side
+    '''
+
+    minx, miny, maxx, maxy = total_bounds
+
+    side = 2 ** level
+
+    def cell(low, high, start, end):
+
+        # Empty shapes have no bounds, and may go anywhere
+        center = np.nan_to_num((bounds[:, low] + bounds[:, high]) / 2)
+
+        return np.clip((center - start) / max(end - start, 1e-12) * side, 0, side - 1).astype(np.int64)
+
+    x, y = cell(0, 2, minx, maxx), cell(1, 3, miny, maxy)
+
+    distance = np.zeros(len(bounds), dtype=np.int64)
+
+    # Goes down the quadrants of the curve, turning each one so that it starts where the last one ended
+    size = side // 2
+
+    while size > 0:
+
+        rx, ry = (x & size) > 0, (y & size) > 0
+
+        distance += size * size * ((3 * rx) ^ ry)
+
+        flip = rx & ~ry
+
+        x, y = np.where(flip, side - 1 - x, x), np.where(flip, side - 1 - y, y)
+
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+
+        size //= 2
+
+    return distance
+
+def pack_nodes(bounds):
+    '''
+    Packs the tracts, which are stored in Hilbert order,
+    in nodes of NODE_SIZE tracts each. Returns where the
+    tracts of each node start and the bounds of the nodes.
+    They are cheap to find from the bounds of the tracts,
+    so they are packed whenever a quadrant is loaded instead
+    of being saved with it
+    '''
+
+    node_offsets = np.append(np.arange(0, len(bounds), NODE_SIZE), len(bounds))
+
+    node_bounds = np.column_stack([ reduce(bounds[:, column], node_offsets[:-1]) for reduce, column in BOUNDS ])
+
+    return node_offsets, node_bounds
+
+def join_tract_edges(parts):
+    '''
+    Joins the flat arrays of several quadrants, shifting
+    the offsets of each one to where its edges and its
+    tracts start in the joined arrays
+    '''
+
+    # Starts with empty arrays, as the circle may not reach any populated quadrant
+    joined = {
+
+        "edges": [ np.empty((0, 4)) ],
+        "offsets": [ ],
+        "population": [ np.empty(0) ],
+        "area": [ np.empty(0) ],
+        "bounds": [ np.empty((0, 4)) ],
+        "node_offsets": [ ],
+        "node_bounds": [ np.empty((0, 4)) ]
+
+    }
+
+    edge_start, tract_start = 0, 0
+
+    for part in parts:
+
+        for key in ("edges", "population", "area", "bounds", "node_bounds"):
+
+            joined[key].append(part[key])
+
+        joined["offsets"].append(part['offsets'][:-1] + edge_start)
+
+        joined["node_offsets"].append(part['node_offsets'][:-1] + tract_start)
+
+        edge_start += part['edges'].shape[0]
+
+        tract_start += part['population'].shape[0]
+
+    joined["offsets"].append([ edge_start ])
+
+    joined["node_offsets"].append([ tract_start ])
+
+    tracts = { key: np.concatenate(value) for key, value in joined.items() }
+
+    tracts["offsets"] = tracts["offsets"].astype(int)
+
+    tracts["node_offsets"] = tracts["node_offsets"].astype(int)
+
+    return tracts
+
+###############
+### HELPERS ###
+###############
+
+def expand_ranges(starts, counts):
+    '''
+    Lists every index in the ranges that begin at
+    starts and hold counts items each
+    '''
+
+    # Each index is the start of its range plus how far along the range it is
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+
+def select_edges(tracts, rows):
+    '''
+    Gathers the edges of some of the tracts. Also returns,
+    for each edge, the position of its tract in rows
+    '''
+
+    starts = tracts["offsets"][rows]
+
+    counts = tracts["offsets"][rows + 1] - starts
+
+    position = np.repeat(np.arange(len(rows)), counts)
+
+    return tracts["edges"][expand_ranges(starts, counts)], position
+
+def box_distances(x, y, bounds):
+    '''
+    Finds how far the nearest point and the farthest
+    corner of each box are from the point (x, y)
+    '''
+
+    minx, miny, maxx, maxy = bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3]
+
+    nearest = np.hypot(np.clip(x, minx, maxx) - x, np.clip(y, miny, maxy) - y)
+
+    farthest = np.hypot(np.maximum(abs(minx - x), abs(maxx - x)), np.maximum(abs(miny - y), abs(maxy - y)))
+
+    return nearest, farthest
+
+def sector_areas(edges, x, y, radius):
+    '''
+    Computes, for every edge, the signed area of the part of
+    the circle that lies within the triangle formed by the edge
+    and the center of the circle. The edge enters and leaves the
+    circle at most once each: the stretches outside of it add a
+    circular sector and the stretch inside adds a triangle
+    '''
+
+    ax, ay = edges[:, 0] - x, edges[:, 1] - y
+
+    bx, by = edges[:, 2] - x, edges[:, 3] - y
+
+    dx, dy = bx - ax, by - ay
+
+    # Solves |a + t * (b - a)| = radius for t
+    qa = dx * dx + dy * dy
+
+    qb = ax * dx + ay * dy
+
+    qc = ax * ax + ay * ay - radius * radius
+
+    discriminant = qb * qb - qa * qc
+
+    crosses = (qa > 0) & (discriminant > 0)
+
+    root = np.sqrt(np.where(crosses, discriminant, 0))
+
+    denominator = np.where(crosses, qa, 1)
+
+    t0 = np.where(crosses, np.clip((-qb - root) / denominator, 0, 1), 0)
+
+    t1 = np.where(crosses, np.clip((-qb + root) / denominator, 0, 1), 0)
+
+    p0x, p0y = ax + t0 * dx, ay + t0 * dy
+
+    p1x, p1y = ax + t1 * dx, ay + t1 * dy
+
+    def angle(ux, uy, vx, vy):
+
+        return np.arctan2(ux * vy - uy * vx, ux * vx + uy * vy)
+
+    sectors = angle(ax, ay, p0x, p0y) + angle(p1x, p1y, bx, by)
+
+    chord = p0x * p1y - p0y * p1x
+
+    return (radius * radius * sectors + chord) / 2
+
+##############
+### RADIUS ###
+##############
+
+def measure_distances(point, tracts):
+    '''
+    Bounds how far the nearest point and the farthest
+    vertex of each tract are from the user, using the
+    bounds saved with the edges. Does the same for the
+    nodes of the packed index
+    '''
+
+    x, y = point.x, point.y
+
+    nearest, farthest = box_distances(x, y, tracts["bounds"])
+
+    node_nearest, node_farthest = box_distances(x, y, tracts["node_bounds"])
+
+    return {
+
+        "nearest": nearest,
+        "farthest": farthest,
+        "population": tracts["population"],
+        "node_nearest": node_nearest,
+        "node_farthest": node_farthest
+
+    }
+
+def make_population_counter(point, tracts, reach):
+    '''
+    Same as radius.make_population_counter, but the
+    tracts crossed by the circle are measured with
+    the closed formula instead of being clipped, and
+    they are only looked for in the nodes of the
+    packed index that the circle crosses
+    '''
+
+    x, y = point.x, point.y
+
+    population, nearest, farthest = reach["population"], reach["nearest"], reach["farthest"]
+
+    node_nearest, node_farthest = reach["node_nearest"], reach["node_farthest"]
+
+    order = np.argsort(farthest)
+
+    sorted_farthest = farthest[order]
+
+    people_within = np.concatenate([ [0], np.cumsum(population[order]) ])
+
+    def counter(radius):
+
+        people_inside = people_within[ np.searchsorted(sorted_farthest, radius, side='right') ]
+
+        # Only the nodes crossed by the circle may hold tracts that are crossed too
+        nodes = np.flatnonzero((node_nearest < radius) & (node_farthest > radius))
+
+        starts = tracts["node_offsets"][nodes]
+
+        candidates = expand_ranges(starts, tracts["node_offsets"][nodes + 1] - starts)
+
+        boundary = candidates[ (nearest[candidates] < radius) & (farthest[candidates] > radius) ]
+
+        edges, position = select_edges(tracts, boundary)
+
+        def measure(edges):
+
+            return sector_areas(edges, x, y, radius)
+
+        parallel = len(boundary) >= settings.CLIP_THREADS_MIN_TRACTS
+
+        covered = np.bincount(position, weights=map_chunks(measure, edges, parallel), minlength=len(boundary))
+
+        share = covered / tracts["area"][boundary]
+
+        return round(people_inside + (population[boundary] * share).sum())
+
+    return counter
@@ -13,7 +13,6 @@ from shapely.geometry import Point, Polygon, MultiPoint
 from shapely.ops import unary_union
 import glob, os, random, shutil
 
-gpd.options.use_pygeos = True
 pd.options.mode.chained_assignment = None  # default='warn'
 
 def read_file(fpath):
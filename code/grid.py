@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+In this script, we place the bounding boxes made by
+divide_bbox back in their grid. Since the grid covers a
+fixed rectangle, finding the box that holds a point is
+just a matter of dividing its coordinates by the size of
+a box, with no need to test every polygon of the index
+'''
+
+import numpy as np
+
+###############
+### PREPARE ###
+###############
+
+def grid_positions(bboxes, rectangle, nrows, ncols):
+    '''
+    Finds the row and column of each bounding box, using
+    the same division as divide_bbox. Returns them along
+    with the parameters of the grid
+    '''
+
+    minx, miny, maxx, maxy = rectangle.bounds
+
+    dx = (maxx - minx) / nrows
+
+    dy = (maxy - miny) / ncols
+
+    grid = {
+
+        "origin": np.array([ minx, miny ]),
+        "cell": np.array([ dx, dy ]),
+        "shape": (int(round((maxy - miny) / dy)), int(round((maxx - minx) / dx)))
+
+    }
+
+    bounds = bboxes.geometry.bounds
+
+    rows = np.round((bounds.miny.values - miny) / dy).astype(int)
+
+    cols = np.round((bounds.minx.values - minx) / dx).astype(int)
+
+    return grid, rows, cols
+
+def save_grid_lookup(bboxes, rectangle, nrows, ncols, fpath):
+    '''
+    Saves the parameters of the grid and, for each of
+    its cells, the row of the index that describes it.
+    Cells left out of the index get -1
+    '''
+
+    grid, rows, cols = grid_positions(bboxes, rectangle, nrows, ncols)
+
+    index_row = np.full(grid["shape"], -1)
+
+    index_row[rows, cols] = np.arange(len(bboxes))
+
+    np.savez(fpath, origin=grid["origin"], cell=grid["cell"], index_row=index_row)
+
+def read_grid_lookup(fpath):
+    '''
+    Loads the lookup saved by save_grid_lookup
+    '''
+
+    with np.load(fpath) as data:
+
+        return { key: data[key] for key in data.files }
+
+###############
+### QUERIES ###
+###############
+
+def locate(lookup, x, y):
+    '''
+    Returns the row of the index that describes the cell
+    holding the point (x, y), or -1 if there is none
+    '''
+
+    (x0, y0), (dx, dy) = lookup["origin"].tolist(), lookup["cell"].tolist()
+
+    height, width = lookup["index_row"].shape
+
+    row, col = (y - y0) // dy, (x - x0) // dx
+
+    # Checked before turning them into integers, which points far away (or nan) would overflow
+    if not (0 <= row < height and 0 <= col < width):
+
+        return -1
+
+    return lookup["index_row"][int(row), int(col)]
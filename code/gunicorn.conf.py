@@ -0,0 +1,8 @@
+'''
+Settings for gunicorn. With PRELOAD, the app is imported,
+and the reference data loaded, once in the master process
+'''
+
+import os
+
+preload_app = bool(int(os.environ.get("PRELOAD", 0)))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+A cache that keeps the most recently used values in memory,
+shared by quadrant_cache.py and result_cache.py. Each value
+has a size, and the values that were used least recently are
+dropped when the sizes add up to more than the capacity. The
+values may also expire, and they are all dropped when the
+data that they were computed from is read again
+'''
+
+from collections import OrderedDict
+import threading, time
+
+class LRUCache:
+    '''
+    Keeps values under their keys, safe to share between the
+    threads of a worker. The capacity and the time to live,
+    in seconds, are functions, so that they follow changes to
+    the settings. The measure function gives the size of each
+    value, which is one by default. A time to live of None
+    keeps the values until they are evicted
+    '''
+
+    def __init__(self, capacity, ttl=lambda: None, measure=lambda value: 1):
+
+        self.capacity = capacity
+
+        self.ttl = ttl
+
+        self.measure = measure
+
+        # Maps each key to the time its value expires, its size and the value, from least to most recently used
+        self.entries = OrderedDict()
+
+        # The objects that the values were computed from. When any of them is replaced, the values are dropped
+        self.source = None
+
+        self.counters = { "hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "flushes": 0, "size": 0 }
+
+        self.lock = threading.Lock()
+
+    ###############
+    ### HELPERS ###
+    ###############
+
+    def is_current(self, source):
+
+        old = self.source
+
+        return old is not None and len(old) == len(source) and all(a is b for a, b in zip(old, source))
+
+    def remove(self, key):
+        '''
+        Drops the value under the key. Must hold the lock
+        '''
+
+        _, size, _ = self.entries.pop(key)
+
+        self.counters["size"] -= size
+
+    def evict(self, capacity):
+        '''
+        Drops the least recently used values until the
+        cache fits in the capacity. Must hold the lock
+        '''
+
+        while self.entries and self.counters["size"] > capacity:
+
+            self.remove(next(iter(self.entries)))
+
+            self.counters["evictions"] += 1
+
+    ###############
+    ### QUERIES ###
+    ###############
+
+    def get(self, key, source, compute):
+        '''
+        Returns the value under the key, calling compute()
+        on a miss. The source holds the objects read from the
+        registry that the values depend on. The values are
+        shared by every request, so they must not be changed
+        in place
+        '''
+
+        now = time.monotonic()
+
+        with self.lock:
+
+            if not self.is_current(source):
+
+                if self.entries:
+
+                    self.counters["flushes"] += 1
+
+                self.entries.clear()
+
+                self.counters["size"] = 0
+
+                self.source = source
+
+            cached = self.entries.get(key)
+
+            if cached is not None:
+
+                if cached[0] is None or cached[0] > now:
+
+                    self.entries.move_to_end(key)
+
+                    self.counters["hits"] += 1
+
+                    return cached[2]
+
+                self.remove(key)
+
+                self.counters["expirations"] += 1
+
+            self.counters["misses"] += 1
+
+        # Computes outside of the lock, so that a slow value doesn't hold up the others
+        value = compute()
+
+        size = self.measure(value)
+
+        capacity = self.capacity()
+
+        with self.lock:
+
+            # Values larger than the whole capacity are never kept
+            if size <= capacity and self.is_current(source) and key not in self.entries:
+
+                ttl = self.ttl()
+
+                self.entries[key] = (None if ttl is None else now + ttl, size, value)
+
+                self.counters["size"] += size
+
+                self.evict(capacity)
+
+        return value
+
+    def stats(self):
+        '''
+        Reports how well the cache is doing
+        '''
+
+        with self.lock:
+
+            lookups = self.counters["hits"] + self.counters["misses"]
+
+            return dict(self.counters, entries=len(self.entries), capacity=self.capacity(), hit_ratio=self.counters["hits"] / lookups if lookups else 0)
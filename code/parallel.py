@@ -0,0 +1,46 @@
+'''
+A thread pool that splits the work on large arrays
+of tracts across the cores of the machine. Shapely 2
+and NumPy release the GIL while they crunch arrays,
+so the threads do run side by side
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import settings
+
+# Created on first use, so that each gunicorn worker gets its own after forking
+pool = None
+
+def get_pool():
+    '''
+    Returns the shared thread pool
+    '''
+
+    global pool
+
+    if pool is None:
+
+        pool = ThreadPoolExecutor(max_workers=settings.CLIP_THREADS)
+
+    return pool
+
+def map_chunks(function, array, parallel=True):
+    '''
+    Applies the function to the array, split in one chunk
+    per thread, and joins the results in order. Runs serially
+    when threads are turned off or the caller says the work
+    is too small to be worth it
+    '''
+
+    threads = settings.CLIP_THREADS
+
+    if not parallel or threads < 2 or len(array) < threads:
+
+        return function(array)
+
+    bounds = np.linspace(0, len(array), threads + 1).astype(int)
+
+    futures = [ get_pool().submit(function, array[start:end]) for start, end in zip(bounds[:-1], bounds[1:]) ]
+
+    return np.concatenate([ future.result() for future in futures ])
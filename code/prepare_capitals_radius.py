@@ -4,9 +4,10 @@ for each capital in the country and saves it
 to a JSON file
 '''
 
-from run_query import parse_input, get_covid_count, find_user_area, find_radius
+from query_engine import engine
+from run_query import parse_input, get_covid_count
 import geopandas as gpd
-import json
+import json, registry
 
 def compute(capitals_data):
 
@@ -18,13 +19,7 @@ def compute(capitals_data):
 
         point = parse_input(point)
  
-        gdf = find_user_area(point, target)
-            
-        gdf["geometry"] = gdf.geometry.buffer(0)
-            
-        spatial_index = gdf.sindex
-            
-        radius_data = find_radius(point, gdf, spatial_index, target)
+        radius_data = engine.find_radius(point, target)
 
         output = {
 
@@ -36,6 +31,25 @@ def compute(capitals_data):
 
     return capitals_data
 
+def add_centroids(capitals_data):
+    '''
+    Saves the centroid of each capital along with it, so
+    that the query can find the nearest one without going
+    through the geometries of city_info.feather
+    '''
+
+    cities_info = registry.city_info()
+
+    centroids = dict(zip(cities_info.code_muni, cities_info.geometry))
+
+    for capital in capitals_data:
+
+        centroid = centroids[capital["code_muni"]]
+
+        capital["centroid"] = [ centroid.x, centroid.y ]
+
+    return capitals_data
+
 def save(data, fpath):
     
     fname = f"{fpath}capitals_radius.json"
@@ -222,6 +236,8 @@ def main():
 
     compute(capitals_data)
 
+    add_centroids(capitals_data)
+
     save(capitals_data, "/app/output/")
 
 if __name__ == "__main__":
@@ -4,9 +4,11 @@ Brazilian cities in geofeather file, as well
 as a bounding box for its polygons
 '''
 
+from city_search import build_city_locator
+from schema import CITY_INFO, apply_schema, frame_bytes, report_savings
 import geopandas as gpd
 import pandas as pd
-import warnings 
+import settings, warnings 
 
 warnings.filterwarnings('ignore', message='.*initial implementation of Parquet.*')
 warnings.filterwarnings('ignore', message='.*to re-project geometries to a projected CRS before this operation.')
@@ -120,10 +122,22 @@ def main():
 
 	save_file(gdf, "/app/output/city_outlines.feather")
 
+	# Lets the query find the city of the user without reading the outlines on every request
+	locator = build_city_locator(gdf, settings.CITY_SIMPLIFY_TOLERANCE)
+
+	save_file(locator, "/app/output/city_locator.feather")
+
 	gdf = get_bbox(gdf)
 
 	gdf = get_centroids(gdf)
 
+	# Keeps only what the query reads, in compact types
+	before = frame_bytes(gdf)
+
+	gdf = apply_schema(gdf, CITY_INFO)
+
+	report_savings("city_info.feather", before, frame_bytes(gdf))
+
 	save_file(gdf, "/app/output/city_info.feather")
 
 if __name__ == "__main__":
@@ -11,10 +11,16 @@ script
 from shapely.geometry import Polygon, MultiPolygon, LineString
 from shapely.ops import split
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-import glob, multiprocessing, os, re, shutil
+import multiprocessing, settings, shapely
+from coverage import hilbert_distances
+from schema import report_savings
+from simplify import reduce_geometries, report_error
+from tract_store import close_store_writer, discard_store_writer, open_store_writer, write_quadrant
+from grid import save_grid_lookup
+from quadtree import save_quadtree
 
-gpd.options.use_pygeos = True
 pd.set_option('display.float_format', lambda x: '%.5f' % x)
 
 def read_data(path_to_tracts, path_to_shp):
@@ -88,38 +94,15 @@ def divide_bbox(rectangle, nrows, ncols):
 
 
 
-def find_neighbors(row, gdf):
-    '''
-    Finds all the polygons in the GeoDataFrame
-    that are neighbors to the current row
-    '''
-
-    neighbors = gdf [ ~gdf.geometry.disjoint(row.geometry)].id_no.astype(str).tolist() 
-    
-    neighbor_count = len(neighbors)
-    
-    neighbors = "|".join(neighbors)
-
-    return pd.Series({
-        "neighbors": neighbors,
-        "neighbor_count": neighbor_count
-    })
-
-
-
-
 def find_intersections(tracts, spatial_index, area):
     '''
     Finds all the polygons that intersect a given area
     '''
     
-    # Uses Geopandas/PyGeos rtree to pre-filter the tracts
-    nearby_index = list(spatial_index.intersection(area.bounds))
+    # Uses the STRtree to find the tracts that do intersect with the area
+    nearby_index = spatial_index.query(area, predicate="intersects")
     
-    nearby_tracts = tracts.iloc[nearby_index]
-
-    # Selects the tracts that do intersect with the area
-    matches = nearby_tracts [ nearby_tracts.geometry.intersects(area)]
+    matches = tracts.iloc[nearby_index]
 
     return matches
 
@@ -152,21 +135,70 @@ def compute_population_in_area(matches, area):
 
     matches['POP_INTER'] = population_in_intersection.round()
 
-    return matches.reset_index(drop=True)
+    return describe_geometries(matches.reset_index(drop=True))
+
+
+
+
+def describe_geometries(matches):
+    '''
+    Fixes the shapes that the clipping left invalid, once and
+    for all, and stores what the query needs to know about
+    each shape: its area, its bounds and the smallest circle
+    that encloses it
+    '''
+
+    geometries = np.asarray(matches.geometry.values)
+
+    invalid = ~shapely.is_valid(geometries)
+
+    geometries[invalid] = shapely.buffer(geometries[invalid], 0)
+
+    matches['geometry'] = geometries
+
+    matches['area'] = shapely.area(geometries)
+
+    matches[['minx', 'miny', 'maxx', 'maxy']] = shapely.bounds(geometries)
+
+    circle_center = shapely.centroid(shapely.minimum_bounding_circle(geometries))
+
+    matches['circle_x'], matches['circle_y'] = shapely.get_x(circle_center), shapely.get_y(circle_center)
+
+    matches['circle_radius'] = shapely.minimum_bounding_radius(geometries)
+
+    return matches
+
+
+
+
+def sort_by_hilbert_curve(matches, area):
+    '''
+    Sorts the tracts along a Hilbert curve that fills the
+    area, so that the packed index saved with the edges
+    groups tracts that lie near each other
+    '''
+
+    if matches.shape[0] == 0:
+        return matches
 
+    distance = hilbert_distances(matches[['minx', 'miny', 'maxx', 'maxy']].values, area.bounds)
 
+    return matches.iloc[np.argsort(distance, kind='stable')].reset_index(drop=True)
 
 
-def split_tracts(row, output_dir, sindex, tracts):
+
+
+def split_tracts(row, store, sindex, tracts):
     '''
     Splits the census tracts in equally sized bounding boxes, 
-    and saves each one to a .feather file to avoid a huge load time 
-    when doing the proper data processing. Note that this function
-    does alter the input geometries and their populations according
-    to the interception with the bounding box.
+    and saves each one as a record batch of the tract store to
+    avoid a huge load time when doing the proper data processing.
+    Note that this function does alter the input geometries and
+    their populations according to the interception with the
+    bounding box.
     '''
 
-    def f(bbox, index, output_dir, sindex, tracts):
+    def f(bbox, index, store, sindex, tracts):
         '''
         The df.apply function above is simply a wrapper for this
         function, which does the work item by item
@@ -178,21 +210,26 @@ def split_tracts(row, output_dir, sindex, tracts):
 
         matches = compute_population_in_area(matches, bbox)
 
+        # Keeps tracts that are close to each other close in the files, too
+        matches = sort_by_hilbert_curve(matches, bbox)
+
         # Adds relevant information to the bboxes dataframe
 
         total_population = matches.POP_INTER.sum()     
 
-        fname =  f'bbox-{index}.feather'
+        # Lines and points left by the clipping hold no one, so they aren't saved
+        matches = matches [ matches['area'] > 0 ]
 
-        fpath = output_dir + fname
+        batch = -1
         
-        # If relevant, saves
+        # If relevant, saves. The store keeps only the people of the part
+        # of each tract that falls inside the quadrant
         if matches.shape[0] != 0:
             
-            matches.to_feather(fpath)
+            batch = write_quadrant(store, matches)
             
         return pd.Series({
-            "fpath": fpath,
+            "batch": batch,
             "total_population": total_population
         })
                 
@@ -204,7 +241,7 @@ def split_tracts(row, output_dir, sindex, tracts):
     
     index = row.name
     
-    return f(bbox, index, output_dir, sindex, tracts)
+    return f(bbox, index, store, sindex, tracts)
 
 
 
@@ -221,6 +258,15 @@ def main():
     # gdf.to_feather("/app/output/setores_censitarios.feather")    
     
     gdf.geometry = gdf.geometry.buffer(0)
+
+    # Drops the digits and vertices that no radius needs, and checks what that costs
+    original = gdf.geometry.values
+
+    gdf.geometry = reduce_geometries(original, settings.PRECISION_GRID, settings.SIMPLIFY_TOLERANCE)
+
+    if settings.SIMPLIFY_SAMPLES > 0:
+
+        report_error(original, gdf.geometry.values, gdf.populacao_residente.values, settings.SIMPLIFY_SAMPLES)
         
     sindex = gdf.sindex
 
@@ -241,36 +287,39 @@ def main():
     
     bboxes.crs = gdf.crs
 
-    # Save a file for each bounding box and its tracts
-            
-    # Make sure that the output directory is empty, avoiding overwrites
-    directory =  "/app/output/setores_censitarios_divididos_feather/"
-
-    if not os.path.exists(directory):
-        
-        os.makedirs(directory)
-    
-            
-    for f in glob.glob(directory + "*"):
-        
-        os.remove(f)
+    # Save a record batch for each bounding box and its tracts, all in the same file
+    store = open_store_writer("/app/output/setores_censitarios.arrow")
     
     # Splits the tracts in bboxes, extracting the relevant information
-    # Note that the function also saves files to the directory and
+    # Note that the function also saves the tracts to the store and
     # adjusts the population according to the intersections
-    new_data = bboxes.apply(split_tracts, args=[directory, sindex, gdf], axis=1)
+    try:
+
+        new_data = bboxes.apply(split_tracts, args=[store, sindex, gdf], axis=1)
 
-    bboxes['fpath'] = new_data["fpath"]
+    except:
+
+        discard_store_writer(store)
+
+        raise
+
+    close_store_writer(store)
+
+    report_savings("setores_censitarios.arrow", store["input_bytes"], store["stored_bytes"])
+
+    bboxes['batch'] = new_data["batch"].astype(int)
     bboxes['total_population'] = new_data["total_population"]
         
     # Remove from the data table all the bounding boxes that contain no tracts
-    saved_files = glob.glob(directory + "*.feather")
-    meaningful_bboxes = [ int(re.search('bbox\-(\d+)\.feather', file).group(1)) for file in saved_files ]
-    bboxes = bboxes.loc[meaningful_bboxes].reset_index(drop=True)
+    bboxes = bboxes [ bboxes.batch >= 0 ].reset_index(drop=True)
 
-    # Finds the neighbors and counts
-    bboxes[['neighbors', 'neighbor_count']] = bboxes.apply(find_neighbors, args=[bboxes], axis=1)    
     bboxes.to_feather("/app/output/index_tracts_bboxes.feather")
+
+    # Lets the query find the quadrant of the user without testing the polygons
+    save_grid_lookup(bboxes, brazil_bbox, 150, 150, "/app/output/index_tracts_bboxes.npz")
+
+    # Sums the population of the quadrants in ever larger blocks
+    save_quadtree(bboxes, brazil_bbox, 150, 150, "/app/output/index_tracts_quadtree.npz")
     
     return bboxes
 
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Keeps the most recently used quadrants of the tract store
+in memory, already decoded and ready for the query. Users
+that are close to each other need the same quadrants, so
+the crowded cities end up being served from memory while
+the rest of the country is still read from the store. The
+cache holds at most QUADRANT_CACHE_BYTES, evicting the
+quadrants that were used least recently
+'''
+
+from lru import LRUCache
+from schema import frame_bytes
+import settings
+
+###############
+### HELPERS ###
+###############
+
+def measure(quadrant):
+    '''
+    Estimates how many bytes a quadrant takes in memory
+    '''
+
+    if isinstance(quadrant, dict):
+
+        return sum(value.nbytes for value in quadrant.values())
+
+    return frame_bytes(quadrant)
+
+# Maps (coverage mode, id_no) to the contents of each quadrant
+cache = LRUCache(lambda: settings.QUADRANT_CACHE_BYTES, measure=measure)
+
+###############
+### QUERIES ###
+###############
+
+def get(store, key, loader):
+    '''
+    Returns the quadrant under the key, calling loader()
+    to read it on a miss. When the registry opens a new
+    store, the quadrants read from the old one are dropped
+    '''
+
+    return cache.get(key, (store,), loader)
+
+def stats():
+
+    return cache.stats()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+In this script, we aggregate the population of the grid
+of tract quadrants in a quadtree: each level sums 2 x 2
+blocks of the level below, up to a single block holding
+the whole country. When a block falls entirely inside a
+circle its population is added at once, so only the
+quadrants crossed by the border of the circle need to
+have their tracts loaded
+'''
+
+from grid import grid_positions
+import numpy as np
+
+###############
+### PREPARE ###
+###############
+
+def save_quadtree(bboxes, rectangle, nrows, ncols, fpath):
+    '''
+    Places the quadrants saved by prepare_tracts_bboxes.py
+    back in their grid and saves the population of every
+    level of the tree
+    '''
+
+    grid, rows, cols = grid_positions(bboxes, rectangle, nrows, ncols)
+
+    shape = grid["shape"]
+
+    population = np.zeros(shape)
+
+    population[rows, cols] = bboxes.total_population.values
+
+    id_no = np.full(shape, -1)
+
+    id_no[rows, cols] = bboxes.id_no.values
+
+    # Summed-area table: the people in any block of quadrants, such as the rings around the user, take four lookups
+    prefix = np.zeros((shape[0] + 1, shape[1] + 1))
+
+    prefix[1:, 1:] = population.cumsum(axis=0).cumsum(axis=1)
+
+    levels = [ population ]
+
+    while levels[-1].size > 1:
+
+        level = levels[-1]
+
+        height, width = level.shape
+
+        # Odd sides get an empty row or column, so that every block has 2 x 2 children
+        padded = np.zeros((height + height % 2, width + width % 2))
+
+        padded[:height, :width] = level
+
+        levels.append(padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).sum(axis=(1, 3)))
+
+    np.savez(fpath,
+             origin=grid["origin"],
+             cell=grid["cell"],
+             id_no=id_no,
+             prefix=prefix,
+             **{ f"level_{index}": level for index, level in enumerate(levels) })
+
+def read_quadtree(fpath):
+    '''
+    Loads the quadtree saved by save_quadtree
+    '''
+
+    with np.load(fpath) as data:
+
+        count = len([ key for key in data.files if key.startswith("level_") ])
+
+        return {
+
+            "origin": data["origin"],
+            "cell": data["cell"],
+            "id_no": data["id_no"],
+            "prefix": data["prefix"],
+            "levels": [ data[f"level_{index}"] for index in range(count) ]
+
+        }
+
+###############
+### QUERIES ###
+###############
+
+def block_distances(tree, x, y, rows, cols, depth=0):
+    '''
+    Finds how far the nearest point and the farthest
+    corner of some blocks of the given depth of the
+    tree are from the point (x, y). Depth 0 holds the
+    quadrants themselves
+    '''
+
+    (x0, y0), (dx, dy) = tree["origin"], tree["cell"]
+
+    width, height = dx * 2 ** depth, dy * 2 ** depth
+
+    minx, miny = x0 + cols * width, y0 + rows * height
+
+    maxx, maxy = minx + width, miny + height
+
+    nearest = np.hypot(np.clip(x, minx, maxx) - x, np.clip(y, miny, maxy) - y)
+
+    farthest = np.hypot(np.maximum(abs(minx - x), abs(maxx - x)), np.maximum(abs(miny - y), abs(maxy - y)))
+
+    return nearest, farthest
+
+def select_cells(tree, x, y, inner, outer):
+    '''
+    Walks down the quadtree around the point (x, y). Returns
+    the population of the blocks that are entirely inside the
+    inner circle, plus the rows and columns of the populated
+    quadrants that reach into the ring between the inner and
+    the outer circle
+    '''
+
+    levels = tree["levels"]
+
+    top = len(levels) - 1
+
+    rows, cols = [ index.ravel() for index in np.indices(levels[top].shape) ]
+
+    people_inside = 0
+
+    for depth in range(top, -1, -1):
+
+        population = levels[depth][rows, cols]
+
+        nearest, farthest = block_distances(tree, x, y, rows, cols, depth)
+
+        inside = farthest <= inner
+
+        people_inside += population[inside].sum()
+
+        crossing = ~inside & (nearest < outer) & (population > 0)
+
+        rows, cols = rows[crossing], cols[crossing]
+
+        if depth == 0:
+            break
+
+        # Moves on to the 2 x 2 children of the blocks that cross the ring
+        rows = (rows[:, None] * 2 + [ 0, 0, 1, 1 ]).ravel()
+
+        cols = (cols[:, None] * 2 + [ 0, 1, 0, 1 ]).ravel()
+
+        height, width = levels[depth - 1].shape
+
+        exists = (rows < height) & (cols < width)
+
+        rows, cols = rows[exists], cols[exists]
+
+    return people_inside, rows, cols
+
+def total_population(tree):
+    '''
+    Returns the population of the whole grid
+    '''
+
+    return tree["levels"][-1].sum()
+
+def bracket_rings(tree, x, y, target):
+    '''
+    Binary searches the rings of quadrants around the one
+    that holds the point (x, y) for the first square of rings
+    with the target population. A circle that covers the whole
+    square is surely large enough, and one that fits in the
+    square before it is surely too small. Returns both radiuses
+    '''
+
+    (x0, y0), (dx, dy) = tree["origin"].tolist(), tree["cell"].tolist()
+
+    prefix = tree["prefix"]
+
+    height, width = prefix.shape[0] - 1, prefix.shape[1] - 1
+
+    row, col = (y - y0) // dy, (x - x0) // dx
+
+    # Points far away from the grid would overflow the integers, and there's no one around them anyway
+    if not (0 <= row < height and 0 <= col < width):
+        raise ValueError("ERRO FATAL: input fora do Brasil continental ou ambíguo.")
+
+    row, col = int(row), int(col)
+
+    def square(rings):
+
+        top, bottom = min(max(row - rings, 0), height), min(max(row + rings + 1, 0), height)
+
+        left, right = min(max(col - rings, 0), width), min(max(col + rings + 1, 0), width)
+
+        return prefix[bottom, right] - prefix[top, right] - prefix[bottom, left] + prefix[top, left]
+
+    low, high = 0, max(height, width) + max(abs(row), abs(col))
+
+    while low < high:
+
+        middle = (low + high) // 2
+
+        if square(middle) < target:
+
+            low = middle + 1
+
+        else:
+
+            high = middle
+
+    def bounds(rings):
+
+        minx, miny = x0 + (col - rings) * dx, y0 + (row - rings) * dy
+
+        maxx, maxy = x0 + (col + rings + 1) * dx, y0 + (row + rings + 1) * dy
+
+        return minx, miny, maxx, maxy
+
+    minx, miny, maxx, maxy = bounds(low)
+
+    outer = np.hypot(max(x - minx, maxx - x), max(y - miny, maxy - y))
+
+    if low == 0:
+
+        return 0, outer
+
+    minx, miny, maxx, maxy = bounds(low - 1)
+
+    return min(x - minx, maxx - x, y - miny, maxy - y), outer
+
+def bracket_radius(tree, x, y, target):
+    '''
+    Finds an interval of radiuses that surely contains the
+    one holding the target population. Below the lower end,
+    even counting every quadrant touched by the circle isn't
+    enough. Above the upper end, the quadrants entirely inside
+    of it are already enough. The search starts from the
+    rings found by bracket_rings
+    '''
+
+    dx, dy = tree["cell"]
+
+    inner, outer = bracket_rings(tree, x, y, target)
+
+    def most(radius):
+
+        people_inside, rows, cols = select_cells(tree, x, y, radius, radius)
+
+        return people_inside + tree["levels"][0][rows, cols].sum()
+
+    def least(radius):
+
+        return select_cells(tree, x, y, radius, radius)[0]
+
+    def bisect(count):
+
+        low, high = inner, outer
+
+        # A hundredth of a quadrant is precise enough
+        while high - low > min(dx, dy) / 100:
+
+            middle = (low + high) / 2
+
+            if count(middle) < target:
+
+                low = middle
+
+            else:
+
+                high = middle
+
+        return low, high
+
+    return bisect(most)[0], bisect(least)[1]
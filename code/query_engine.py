@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+The engine that answers the queries. Both routes of app.py,
+/coords and /coords_deaths, and prepare_capitals_radius.py
+share the same engine, so the reference data, the indexes
+and the caches are loaded once per worker and any change to
+the query is made in a single place. Only the target, the
+number of people that the circle must hold, differs
+'''
+
+from city_search import locate_city, nearest_capital, nearest_vanishing_city
+from grid import locate
+from quadtree import bracket_radius, select_cells, total_population
+from radius import circle_radius, describe_circle, find_radius
+from shapely.geometry import Point
+from tract_store import read_tract_arrays, read_tract_frame, slice_quadrant
+import quadrant_cache, registry, result_cache, settings
+
+class QueryEngine:
+    '''
+    Finds, for a point and a target, the circle around the
+    point that holds the target population and the cities
+    to show along with it. The reference data comes from the
+    registry, which reads each file again when prepare.py or
+    update.py rewrite it
+    '''
+
+    def __init__(self, solver="profile", tolerance=.1):
+
+        self.solver = solver
+
+        self.tolerance = tolerance
+
+    def find_user_area(self, point, target):
+
+        '''
+        Finds the area that we will need to
+        process according to the position of the point.
+        The quadtree brackets the radius that holds the target
+        and sums the quadrants entirely inside the lower end.
+        Returns a function that loads the tracts of a quadrant,
+        which the radius solver only calls when the circle
+        first crosses it, along with the quadtree and the
+        bracket. The tracts come as flat arrays, or as a
+        GeoDataFrame when COVERAGE is set to geos
+        '''
+
+        # Gets the quadrant data, which stays in memory between requests
+
+        reference_map = registry.tract_index()
+
+        lookup = registry.tract_lookup()
+
+        # Finds in which quadrant the point falls
+
+        user_row = locate(lookup, point.x, point.y)
+
+        if user_row < 0:
+            raise ValueError("ERRO FATAL: input fora do Brasil continental ou ambíguo.")
+
+        tree = registry.tract_quadtree()
+
+        if not target > 0:
+            raise ValueError("ERRO FATAL: o número alvo deve ser maior que zero.")
+
+        # No circle holds more people than the whole country, so there's no point in searching
+        if target > total_population(tree):
+            raise ValueError("ERRO FATAL: o número alvo é maior que a população do Brasil.")
+
+        low, high = bracket_radius(tree, point.x, point.y, target)
+
+        bracket = {
+
+            "low": low,
+            "high": high,
+            "people_inside": select_cells(tree, point.x, point.y, low, low)[0]
+
+        }
+
+        mode = settings.COVERAGE
+
+        # With the tracts of the whole country loaded before forking, a quadrant is just a slice of them
+        if settings.PRELOAD and mode == "numpy":
+
+            national = registry.tract_arrays()
+
+            def load_quadrant(id_no):
+
+                return slice_quadrant(national, reference_map.batch[id_no])
+
+            return load_quadrant, tree, bracket
+
+        # The store is memory mapped once per worker, so loading a quadrant only slices it
+        store = registry.tract_store()
+
+        def read_quadrant(id_no):
+
+            batch = reference_map.batch[id_no]
+
+            # The shapes were already made valid by prepare_tracts_bboxes.py
+            if mode == "geos":
+
+                return read_tract_frame(store, batch)
+
+            # The flat arrays skip the geometry decoding
+            return read_tract_arrays(store, batch)
+
+        def load_quadrant(id_no):
+
+            # Nearby users need the same quadrants, so the recent ones are kept decoded
+            return quadrant_cache.get(store, (mode, id_no), lambda: read_quadrant(id_no))
+
+        return load_quadrant, tree, bracket
+
+    def find_user_city(self, point, target, cities_info):
+        '''
+        Finds the city that contains the point
+        and retrieves its data
+        '''
+
+        lookup = registry.city_lookup()
+
+        # If the point is not within the bounding boxes, then it's probably way out of Brazil
+        # There's no point in trying to compute anything
+        if locate(lookup, point.x, point.y) < 0:
+            raise ValueError("ERRO FATAL: input fora do Brasil continental ou ambíguo.")
+
+        # The outlines of the cities stay in memory, indexed, and only points near a border are tested
+        # against the full outline. Weirdly, not all points within Brazil are contained in the shapefile
+        # of its cities, as happens in coastal cities such as Rio de Janeiro. Those get the city with the
+        # nearest centroid -- with the side effect that the app may 'work' in border areas outside of Brazil.
+        # It's better than crashing in a legit location!
+        row = locate_city(registry.city_locator(), point)
+
+        # Takes the specific datapoint
+        user_city = cities_info.iloc[row]
+
+        # Extracts data
+        code_muni = user_city["code_muni"]
+        name_muni = user_city["name_muni"]
+        name_state = user_city["name_muni"]
+        pop_2019 = int(user_city["pop_2019"])
+        city_centroid = user_city["geometry"].centroid.coords[0]
+        miny = user_city["miny"]
+        maxy = user_city["maxy"]
+        minx = user_city["minx"]
+        maxx = user_city["maxx"]
+
+
+        city_data = {
+
+            "code_muni": code_muni,
+            "name_muni": name_muni,
+            "name_state": name_state,
+            "pop_2019": pop_2019,
+            "city_centroid": city_centroid,
+            "bbox":[ (minx, miny), (maxx, maxy) ],
+            "would_vanish": True if (pop_2019 <= target) else False
+
+        }
+
+        return city_data
+
+    def find_neighboring_city(self, point, target, cities_info):
+
+        '''
+        Returns the city with less population than covid-cases
+        that is nearest to the user input point
+        '''
+
+        # The cities are indexed by population once, so any target only searches a few trees
+        row = nearest_vanishing_city(registry.vanishing_cities(), point, target)
+
+        if row < 0:
+            raise ValueError("ERRO FATAL: nenhuma cidade tem população menor que o número alvo.")
+
+        # Fetches the data
+        nearest = cities_info.iloc[row]
+
+        code_muni = nearest['code_muni']
+        name_muni = nearest['name_muni']
+        name_state = nearest['name_state']
+        pop_2019 = int(nearest['pop_2019'])
+        city_centroid = nearest['geometry'].coords[0]
+
+        # Gets bounding box data for this city
+        miny = nearest["miny"]
+        maxy = nearest["maxy"]
+        minx = nearest["minx"]
+        maxx = nearest["maxx"]
+
+        neighbor_data = {
+
+            "code_muni": code_muni,
+            "name_muni": name_muni,
+            "name_state": name_state,
+            "pop_2019": pop_2019,
+            "city_centroid": city_centroid,
+            "bbox":[ (minx, miny), (maxx, maxy) ]
+
+        }
+
+        return neighbor_data
+
+    def choose_capitals(self, point, user_city_id, cities_info):
+        '''
+        Selects the state capital nearest to the point
+        to highlight, making sure it's not the user city.
+        The capitals come from the registry, which reads
+        them again only after update.py rewrites them
+        '''
+
+        capitals = registry.capitals_radius()
+
+        # First is the nearest capital
+        first_capital = nearest_capital(capitals, point, user_city_id)
+
+        # Returns selection as list
+        return [ first_capital ]
+
+
+    def find_radius(self, point, target, solver=None, tolerance=None):
+        '''
+        Finds the circle around the point that holds
+        the target population
+        '''
+
+        # Gets what we need to load the census tracts around the user
+        load_quadrant, tree, bracket = self.find_user_area(point, target)
+
+        solver = solver or self.solver
+
+        tolerance = self.tolerance if tolerance is None else tolerance
+
+        return find_radius(point, load_quadrant, target, solver=solver, tolerance=tolerance, bracket=bracket, tree=tree)
+
+    def query(self, point, target, solver=None, tolerance=None):
+        '''
+        Answers a query through the result cache. Users in
+        the same cell share the radius found for the point
+        the cell was snapped to, but the circle is centered
+        on each of them and their cities are found from
+        where they really are
+        '''
+
+        solver = solver or self.solver
+
+        tolerance = self.tolerance if tolerance is None else tolerance
+
+        if settings.RESULT_CACHE_SIZE <= 0:
+
+            return self.answer(point, target, solver=solver, tolerance=tolerance)
+
+        lookup = registry.tract_lookup()
+
+        # Points off the tracts are answered (or refused) as they are. So are the ones near the coast or a border,
+        # whose cell may be snapped to a point off the tracts
+        if locate(lookup, point.x, point.y) < 0:
+
+            return self.answer(point, target, solver=solver, tolerance=tolerance)
+
+        cell, (x, y) = result_cache.snap(point.x, point.y)
+
+        if locate(lookup, x, y) < 0:
+
+            return self.answer(point, target, solver=solver, tolerance=tolerance)
+
+        # A new count of deaths or new tracts make every radius stale
+        version = (registry.case_count(), registry.tract_quadtree())
+
+        def compute():
+
+            return self.find_radius(Point(x, y), target, solver=solver, tolerance=tolerance)
+
+        cached = result_cache.get((cell, target, solver, tolerance), version, compute)
+
+        radius_data = describe_circle(point, circle_radius(cached), cached["iterations"])
+
+        return self.answer(point, target, radius_data=radius_data)
+
+    def answer(self, point, target, solver=None, tolerance=None, radius_data=None):
+        '''
+        Answers a query: the circle around the point
+        that holds the target population, the city of
+        the user, the nearest city that would vanish
+        and the capital to highlight. The circle may
+        be given, when it comes from the result cache
+        '''
+
+        cities_info = registry.city_info()
+
+        # Finds the area that we will need to highlight along with the respective population
+        if radius_data is None:
+
+            radius_data = self.find_radius(point, target, solver=solver, tolerance=tolerance)
+
+        # Finds informations about the user city
+        city_data = self.find_user_city(point, target, cities_info)
+
+        # If the user city has less population than covid deaths,
+        # the closest city that would vanish is itself
+        if city_data["pop_2019"] <= target:
+            neighbor_data = city_data.copy()
+
+        # Else, finds the closest city with population smaller to the total deaths
+        else:
+            neighbor_data = self.find_neighboring_city(point, target, cities_info)
+
+        # Selects the nearest capital to highlight
+        capitals_data = self.choose_capitals(point, city_data["code_muni"], cities_info)
+
+        output = {
+
+            "radius": radius_data,
+
+            "user_city": city_data,
+
+            "neighboring_city": neighbor_data,
+
+            "capitals_to_highlight": capitals_data
+
+        }
+
+        return output
+
+    def stats(self):
+        '''
+        Reports how the caches of this worker are doing
+        '''
+
+        return { "quadrants": quadrant_cache.stats(), "results": result_cache.stats() }
+
+# Shared by everything that runs in the same worker
+engine = QueryEngine()
@@ -0,0 +1,675 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+This script finds the radius around the user that
+contains as many people as the target number of deaths.
+It is called by the engine in query_engine.py, which
+is shared by both routes and prepare_capitals_radius.py
+'''
+
+from parallel import map_chunks
+from quadtree import block_distances, select_cells
+import numpy as np
+import coverage, settings, shapely
+
+###############
+### HELPERS ###
+###############
+
+def measure_distances(point, tracts):
+    '''
+    Bounds how far the nearest point and the farthest
+    vertex of each tract are from the user, using the bounds
+    and bounding circles stored by prepare_tracts_bboxes.py
+    instead of the geometries. Being a little generous only
+    means that a few more tracts get clipped. Also keeps the
+    geometries and their stored areas as plain arrays, so
+    that the solver iterations don't need to copy the
+    GeoDataFrame around
+    '''
+
+    x, y = point.x, point.y
+
+    area = tracts["area"].values
+
+    # Clipping the tracts to the quadrants may leave lines behind, which hold no one.
+    # A tract split between quadrants only counts the people of its own part
+    population = np.where(area > 0, tracts.POP_INTER.values, 0)
+
+    nearest, corner = coverage.box_distances(x, y, tracts[["minx", "miny", "maxx", "maxy"]].values)
+
+    circle = np.hypot(tracts["circle_x"].values - x, tracts["circle_y"].values - y) + tracts["circle_radius"].values
+
+    return {
+
+        # Empty shapes have no bounds, but they hold no one either
+        "nearest": np.nan_to_num(nearest),
+        "farthest": np.nan_to_num(np.minimum(corner, circle)),
+        "population": np.nan_to_num(population.astype(float)),
+        "geometries": np.asarray(tracts.geometry.values),
+        "area": area
+
+    }
+
+def make_population_counter(point, tracts, reach):
+    '''
+    Returns a function that counts how many people live
+    within a given radius of the point. Tracts whose farthest
+    vertex is within the radius are entirely inside the circle,
+    and those whose nearest point is beyond it are entirely
+    outside, so only the ones left in between are clipped.
+    The tracts are sorted by their farthest vertex once, which
+    lets every iteration of the solver sum the people that
+    are entirely inside with a single lookup
+    '''
+
+    population, nearest, farthest = reach["population"], reach["nearest"], reach["farthest"]
+
+    geometries, area = reach["geometries"], reach["area"]
+
+    order = np.argsort(farthest)
+
+    sorted_farthest = farthest[order]
+
+    people_within = np.concatenate([ [0], np.cumsum(population[order]) ])
+
+    def counter(radius):
+
+        circle = shapely.buffer(point, radius)
+
+        people_inside = people_within[ np.searchsorted(sorted_farthest, radius, side='right') ]
+
+        # Being nearer than the radius already means that the tract intersects the circle
+        boundary = np.flatnonzero((nearest < radius) & (farthest > radius))
+
+        def clip(geometries):
+
+            return shapely.area(shapely.intersection(geometries, circle))
+
+        parallel = len(boundary) >= settings.CLIP_THREADS_MIN_TRACTS
+
+        clipped = map_chunks(clip, geometries[boundary], parallel)
+
+        return round(people_inside + (population[boundary] * clipped / area[boundary]).sum())
+
+    return counter
+
+def make_lazy_counter(point, load, tree, bracket):
+    '''
+    Same as make_population_counter, but the tracts of a
+    quadrant are only loaded when a circle first crosses it.
+    The quadrants that are entirely inside the circle are
+    summed from the quadtree, so they are never loaded.
+    Also returns the reach used to build the population
+    profile: the quadrants of the bracket start as single
+    blocks and are swapped for their tracts, in place,
+    as the counter loads them
+    '''
+
+    x, y = point.x, point.y
+
+    tract_ids = tree["id_no"]
+
+    # The populated quadrants between the ends of the bracket
+    rows, cols = select_cells(tree, x, y, bracket["low"], bracket["high"])[1:]
+
+    nearest, farthest = block_distances(tree, x, y, rows, cols)
+
+    blocks = {
+
+        "id_no": tract_ids[rows, cols],
+        "nearest": nearest,
+        "farthest": farthest,
+        "population": tree["levels"][0][rows, cols]
+
+    }
+
+    reach = { key: blocks[key] for key in ("nearest", "farthest", "population") }
+
+    # What we know about the quadrants already loaded
+    loaded = {
+
+        "id_no": np.empty(0, dtype=int),
+        "farthest": np.empty(0),
+        "population": np.empty(0),
+        "parts": [ ],
+        "reaches": [ ],
+        "counter": None
+
+    }
+
+    def load_quadrants(rows, cols):
+
+        id_nos = tract_ids[rows, cols]
+
+        parts = [ load(id_no) for id_no in id_nos ]
+
+        flat = isinstance(parts[0], dict)
+
+        measure = coverage.measure_distances if flat else measure_distances
+
+        loaded["parts"].extend(parts)
+
+        loaded["reaches"].extend(measure(point, part) for part in parts)
+
+        loaded["id_no"] = np.concatenate([ loaded["id_no"], id_nos ])
+
+        loaded["farthest"] = np.concatenate([ loaded["farthest"], block_distances(tree, x, y, rows, cols)[1] ])
+
+        loaded["population"] = np.concatenate([ loaded["population"], tree["levels"][0][rows, cols] ])
+
+        tract_reach = { key: np.concatenate([ part[key] for part in loaded["reaches"] ]) for key in loaded["reaches"][0] }
+
+        # The GEOS counter only needs the reach, while the NumPy one also needs the edges
+        if flat:
+
+            tracts = coverage.join_tract_edges(loaded["parts"])
+
+            loaded["counter"] = coverage.make_population_counter(point, tracts, tract_reach)
+
+        else:
+
+            loaded["counter"] = make_population_counter(point, None, tract_reach)
+
+        pending = ~np.isin(blocks["id_no"], loaded["id_no"])
+
+        for key in reach:
+
+            reach[key] = np.concatenate([ blocks[key][pending], tract_reach[key] ])
+
+    def counter(radius):
+
+        people_inside, rows, cols = select_cells(tree, x, y, radius, radius)
+
+        missing = ~np.isin(tract_ids[rows, cols], loaded["id_no"])
+
+        if missing.any():
+
+            load_quadrants(rows[missing], cols[missing])
+
+        if loaded["counter"] is None:
+
+            return round(people_inside)
+
+        # Loaded quadrants that are entirely inside the circle were already summed by the quadtree
+        overlap = loaded["population"][ loaded["farthest"] <= radius ].sum()
+
+        return round(people_inside - overlap + loaded["counter"](radius))
+
+    return counter, reach
+
+def build_population_profile(reach):
+    '''
+    Estimates how the population of the loaded tracts
+    accumulates as we move away from the point. The people
+    of each tract are spread between its nearest and its
+    farthest distance to the point, growing with the area
+    of the circle. Returns a function that estimates the
+    population within any radius and the radius that
+    reaches every tract
+    '''
+
+    nearest = reach["nearest"] ** 2
+
+    farthest = reach["farthest"] ** 2
+
+    population = reach["population"]
+
+    # Tracts that are a single point away would divide by zero
+    span = np.where(farthest > nearest, farthest - nearest, 1)
+
+    def profile(radius):
+
+        share = np.clip((radius ** 2 - nearest) / span, 0, 1)
+
+        return np.sum(population * share)
+
+    return profile, np.sqrt(np.max(farthest, initial=0))
+
+def invert_profile(profile, goal, limit, iterations=50, low=0):
+    '''
+    Bisects the population profile looking for
+    the radius that holds the goal population
+    '''
+
+    high = limit
+
+    for iteration in range(iterations):
+
+        middle = (low + high) / 2
+
+        if profile(middle) < goal:
+
+            low = middle
+
+        else:
+
+            high = middle
+
+    return high
+
+###############
+### SOLVERS ###
+###############
+
+def expand_and_fine_tune(reach, counter, target, tolerance=.1, bracket=None, radius=.01, max_iterations=50):
+    '''
+    Grows the radius until the target is met and then
+    shrinks and grows it in ever smaller steps until the
+    population is within the tolerance band. The radius
+    unit is lat/lon degrees. Since the counts are rounded,
+    a narrow band may never be hit, so after max_iterations
+    counts it returns the radius that came closest
+    '''
+
+    iterations = 0
+
+    # The radius whose population came closest to the target so far
+    best = { "radius": radius, "error": np.inf }
+
+    def count(radius):
+
+        nonlocal iterations
+
+        total_people = counter(radius)
+
+        iterations += 1
+
+        if abs(total_people - target) < best["error"]:
+
+            best["radius"], best["error"] = radius, abs(total_people - target)
+
+        return total_people
+
+    # While we don't meet the population target, we keep increasing the radius to grab more people
+    while True:
+
+        total_people = count(radius)
+
+        if iterations >= max_iterations:
+
+            return best["radius"], iterations
+
+        if total_people < target:
+
+            radius = radius * 1.5
+
+            continue
+
+        # Else, finish the iteration
+        else:
+
+            break
+
+
+    # Now we can move into the fine-tuning, removing excess population
+
+    direction = 'shrink'
+
+    fine_tune = .5
+
+    max_tolerance = target * (1 + tolerance)
+
+    min_tolerance = target * (1 - tolerance)
+
+    while iterations < max_iterations:
+
+        if total_people > max_tolerance:
+
+            new_direction = 'shrink'
+
+            radius = radius * (1 - fine_tune)
+
+            total_people = count(radius)
+
+            if total_people <= max_tolerance and total_people >= min_tolerance:
+
+                break
+
+
+        elif total_people < min_tolerance:
+
+            new_direction = 'grow'
+
+            radius = radius * (1 + fine_tune)
+
+            total_people = count(radius)
+
+            if total_people <= max_tolerance and total_people >= min_tolerance:
+
+                break
+
+        else: # It's equal
+
+            break
+
+        if new_direction != direction:
+
+            direction = new_direction
+
+            fine_tune = fine_tune / 2
+
+    else:
+
+        return best["radius"], iterations
+
+    return radius, iterations
+
+def solve_with_brent(reach, counter, target, tolerance=.1, bracket=None, radius=None, max_iterations=50):
+    '''
+    Starts from the given radius, brackets the target with
+    secant steps that assume people grow with the square of
+    the radius and then closes in with Brent's method. Stops
+    as soon as the population is within the tolerance band.
+    When the quadtree already bracketed the radius, goes
+    straight to Brent's method
+    '''
+
+    iterations = 0
+
+    band = target * tolerance
+
+    def excess(radius):
+
+        nonlocal iterations
+
+        iterations += 1
+
+        total_people = counter(radius)
+
+        return total_people - target
+
+    def secant_step(radius, excess_people):
+
+        # How much the radius should change if the density were even
+        ratio = np.sqrt(target / max(excess_people + target, 1))
+
+        if excess_people < 0:
+
+            return radius * min(max(ratio * 1.1, 1.2), 4)
+
+        return radius * max(min(ratio * .9, 1 / 1.2), 1 / 4)
+
+    ##################
+    ### BRACKETING ###
+    ##################
+
+    if bracket and not radius:
+
+        a, b = bracket["low"], bracket["high"]
+
+        fa = excess(a)
+
+        if abs(fa) <= band:
+
+            return a, iterations
+
+        fb = excess(b)
+
+        if abs(fb) <= band:
+
+            return b, iterations
+
+    else:
+
+        a = radius if radius else .01
+
+        fa = excess(a)
+
+        if abs(fa) <= band:
+
+            return a, iterations
+
+        fb = fa
+
+    while (fa < 0) == (fb < 0):
+
+        b = secant_step(a, fa)
+
+        fb = excess(b)
+
+        if abs(fb) <= band:
+
+            return b, iterations
+
+        if (fa < 0) != (fb < 0):
+
+            break
+
+        if iterations >= max_iterations:
+
+            return b, iterations
+
+        a, fa = b, fb
+
+    #############
+    ### BRENT ###
+    #############
+
+    # Follows the classic formulation in Numerical Recipes (zbrent)
+    c, fc = b, fb
+
+    d = e = b - a
+
+    while iterations < max_iterations:
+
+        if (fb > 0) == (fc > 0):
+
+            c, fc = a, fa
+
+            d = e = b - a
+
+        if abs(fc) < abs(fb):
+
+            a, b, c = b, c, b
+
+            fa, fb, fc = fb, fc, fb
+
+        middle = (c - b) / 2
+
+        precision = 1e-9 * abs(b)
+
+        if abs(middle) <= precision:
+
+            break
+
+        if abs(e) >= precision and abs(fa) > abs(fb):
+
+            s = fb / fa
+
+            if a == c:
+
+                # Secant
+                p = 2 * middle * s
+
+                q = 1 - s
+
+            else:
+
+                # Inverse quadratic interpolation
+                q = fa / fc
+
+                r = fb / fc
+
+                p = s * (2 * middle * q * (q - r) - (b - a) * (r - 1))
+
+                q = (q - 1) * (r - 1) * (s - 1)
+
+            if p > 0:
+
+                q = -q
+
+            p = abs(p)
+
+            if 2 * p < min(3 * middle * q - abs(precision * q), abs(e * q)):
+
+                e, d = d, p / q
+
+            else:
+
+                # Falls back to bisection
+                d = e = middle
+
+        else:
+
+            d = e = middle
+
+        a, fa = b, fb
+
+        b = b + d if abs(d) > precision else b + np.copysign(precision, middle)
+
+        fb = excess(b)
+
+        if abs(fb) <= band:
+
+            break
+
+    return b, iterations
+
+def solve_with_profile(reach, counter, target, tolerance=.1, bracket=None, passes=3):
+    '''
+    Reads the radius off the population profile of the
+    loaded tracts and checks it against the real census
+    geometry. The profile is only approximate for the tracts
+    crossed by the circle, so if the check misses the
+    tolerance band we offset the goal by the observed
+    error and try again. Falls back to Brent's method
+    if that doesn't converge
+    '''
+
+    tract_profile, farthest = build_population_profile(reach)
+
+    low, people_inside = 0, 0
+
+    # The quadrants entirely inside the bracket are summed from the quadtree
+    if bracket:
+
+        low, farthest, people_inside = bracket["low"], bracket["high"], bracket["people_inside"]
+
+    def profile(radius):
+
+        return people_inside + tract_profile(radius)
+
+    # The loaded tracts can't hold the target: let the old search handle it
+    if profile(farthest) < target:
+
+        return expand_and_fine_tune(reach, counter, target, tolerance)
+
+    max_tolerance = target * (1 + tolerance)
+
+    min_tolerance = target * (1 - tolerance)
+
+    goal = target
+
+    for attempt in range(passes):
+
+        radius = invert_profile(profile, goal, farthest, low=low)
+
+        total_people = counter(radius)
+
+        if total_people <= max_tolerance and total_people >= min_tolerance:
+
+            return radius, attempt + 1
+
+        # Counting may have loaded new quadrants, which sharpen the profile
+        tract_profile = build_population_profile(reach)[0]
+
+        # The profile overestimates the circle by this much around this radius
+        goal = target + profile(radius) - total_people
+
+        goal = min(max(goal, 0), profile(farthest))
+
+    radius, iterations = solve_with_brent(reach, counter, target, tolerance, bracket=bracket, radius=radius)
+
+    return radius, passes + iterations
+
+SOLVERS = {
+
+    "brent": solve_with_brent,
+    "expand": expand_and_fine_tune,
+    "profile": solve_with_profile
+
+}
+
+###############
+### WRAPPER ###
+###############
+
+def find_radius(point, tracts, target, solver="profile", tolerance=.1, bracket=None, tree=None):
+    '''
+    Finds the circle around the point that holds the
+    target population, give or take the tolerance (a
+    fraction of the target). The tracts are either the
+    flat arrays from tract_store.read_tract_arrays or a
+    GeoDataFrame. Along with the quadtree, they may also
+    be a function that loads the tracts of a quadrant
+    from its id_no, which the solver calls as the circle
+    reaches new quadrants. The solver can be any of the
+    SOLVERS above. Also reports how many times the
+    population had to be counted
+    '''
+
+    if solver not in SOLVERS:
+        raise ValueError(f"ERRO FATAL: solver desconhecido '{solver}'.")
+
+    if not 0 < tolerance < 1:
+        raise ValueError("ERRO FATAL: a tolerância deve estar entre 0 e 1.")
+
+    # An empty circle has no outline to return
+    if not target > 0:
+        raise ValueError("ERRO FATAL: o número alvo deve ser maior que zero.")
+
+    # The counts are whole people, so a band narrower than one person can't be hit
+    tolerance = max(tolerance, 1 / target)
+
+    # Quadrants saved as flat arrays are measured with NumPy, the others with GEOS
+    if tree is not None:
+
+        # Tracts are loaded by the counter itself, as the circle reaches them
+        counter, reach = make_lazy_counter(point, tracts, tree, bracket)
+
+    elif isinstance(tracts, dict):
+
+        reach = coverage.measure_distances(point, tracts)
+
+        counter = coverage.make_population_counter(point, tracts, reach)
+
+    else:
+
+        reach = measure_distances(point, tracts)
+
+        counter = make_population_counter(point, tracts, reach)
+
+    radius, iterations = SOLVERS[solver](reach, counter, target, tolerance, bracket=bracket)
+
+    return describe_circle(point, radius, iterations)
+
+def describe_circle(point, radius, iterations):
+    '''
+    Describes the circle found by find_radius as the
+    front end expects it: its center and a point
+    on its outline
+    '''
+
+    area = point.buffer(radius)
+
+    radius_data = {
+
+        "inner_point": point.coords[0],
+        "outer_point": area.exterior.coords[0],
+        "iterations": iterations
+
+    }
+
+    return radius_data
+
+def circle_radius(radius_data):
+    '''
+    Reads the radius back from the
+    output of describe_circle
+    '''
+
+    (x0, y0), (x1, y1) = radius_data["inner_point"], radius_data["outer_point"]
+
+    return float(np.hypot(x1 - x0, y1 - y0))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Keeps the reference data produced by the prepare scripts
+in memory, so that each worker reads a file only once
+instead of on every request. Before handing out a file we
+check its modification time and size: when update.py (or
+a new run of prepare.py) rewrites it, the next request
+reads it again
+'''
+
+from city_search import read_capitals, read_city_locator, read_vanishing_index
+from grid import read_grid_lookup
+from quadtree import read_quadtree
+from tract_store import open_tract_store, read_national_arrays
+import geopandas as gpd
+import pandas as pd
+import json, os, threading
+
+OUTPUT = "/app/output/"
+
+# Maps each file path and reader to the version and contents of the file
+cache = { }
+
+lock = threading.Lock()
+
+def load(fpath, reader):
+    '''
+    Returns the contents of the file, as read by the
+    reader function. The file is only read again when
+    its modification time or size changes. The contents
+    are shared by every request, so they must not be
+    changed in place
+    '''
+
+    stat = os.stat(fpath)
+
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    with lock:
+
+        cached = cache.get((fpath, reader))
+
+        if cached is None or cached[0] != version:
+
+            cached = (version, reader(fpath))
+
+            cache[(fpath, reader)] = cached
+
+    return cached[1]
+
+###############
+### READERS ###
+###############
+
+def read_json(fpath):
+
+    with open(fpath) as file:
+
+        return json.load(file)
+
+def read_tract_index(fpath):
+    '''
+    Reads the index of the tract quadrants without decoding
+    its polygons, which the grid lookups made unnecessary.
+    Each quadrant points to a record batch of the tract store
+    '''
+
+    return pd.read_feather(fpath, columns=["id_no", "batch"]).set_index("id_no", drop=False)
+
+#################
+### ARTIFACTS ###
+#################
+
+def tract_index():
+
+    return load(OUTPUT + "index_tracts_bboxes.feather", read_tract_index)
+
+def tract_lookup():
+
+    return load(OUTPUT + "index_tracts_bboxes.npz", read_grid_lookup)
+
+def tract_store():
+
+    return load(OUTPUT + "setores_censitarios.arrow", open_tract_store)
+
+def tract_arrays():
+
+    return load(OUTPUT + "setores_censitarios.arrow", read_national_arrays)
+
+def tract_quadtree():
+
+    return load(OUTPUT + "index_tracts_quadtree.npz", read_quadtree)
+
+def city_lookup():
+
+    return load(OUTPUT + "index_city_bboxes.npz", read_grid_lookup)
+
+def city_locator():
+
+    return load(OUTPUT + "city_locator.feather", read_city_locator)
+
+def city_info():
+
+    return load(OUTPUT + "city_info.feather", gpd.read_feather)
+
+def vanishing_cities():
+
+    return load(OUTPUT + "city_info.feather", read_vanishing_index)
+
+def capitals_radius():
+
+    return load(OUTPUT + "capitals_radius.json", read_capitals)
+
+def case_count():
+
+    return load(OUTPUT + "case_count.json", read_json)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Keeps the most recent radiuses in memory. Many users share
+the same coarse position, given by the geolocation of their
+browsers or embedded by a newsroom, so the coordinates are
+snapped to cells of RESULT_CACHE_PRECISION degrees and the
+radius of each cell is computed only once for each target.
+Results expire after RESULT_CACHE_TTL seconds, and are all
+dropped when update.py writes a new count of deaths or
+prepare.py writes new tracts
+'''
+
+from lru import LRUCache
+import settings
+
+# Maps the cell, the target and the solver settings to a radius
+cache = LRUCache(lambda: settings.RESULT_CACHE_SIZE, ttl=lambda: settings.RESULT_CACHE_TTL)
+
+###############
+### HELPERS ###
+###############
+
+def snap(x, y):
+    '''
+    Returns the cell that holds the point (x, y), which
+    is centered on the grid point nearest to it, and the
+    coordinates of that grid point
+    '''
+
+    precision = settings.RESULT_CACHE_PRECISION
+
+    col, row = round(x / precision), round(y / precision)
+
+    return (col, row), (col * precision, row * precision)
+
+###############
+### QUERIES ###
+###############
+
+def get(key, version, compute):
+    '''
+    Returns the result under the key, calling compute()
+    on a miss. The version holds the objects read from the
+    registry that the results depend on
+    '''
+
+    return cache.get(key, version, compute)
+
+def stats():
+
+    return cache.stats()
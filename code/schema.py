@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+In this script, we list the columns that the query actually
+reads from each prepared dataset, along with the most compact
+type that holds them. The prepare scripts drop everything else
+before saving, since every unused column is read from disk and
+kept in memory by each worker, and report how many bytes that
+saved
+'''
+
+import numpy as np
+import shapely
+
+# Municipalities, one row each, with their centroids as geometry
+CITY_INFO = {
+
+    "code_muni": str,
+    "name_muni": str,
+    "name_state": "category",
+    "pop_2019": "int32",
+    "minx": "float64",
+    "miny": "float64",
+    "maxx": "float64",
+    "maxy": "float64"
+
+}
+
+def apply_schema(gdf, columns):
+    '''
+    Keeps only the listed columns, plus the geometry,
+    and casts them to the listed types
+    '''
+
+    gdf = gdf[ list(columns) + [ gdf.geometry.name ] ]
+
+    return gdf.astype(columns)
+
+def frame_bytes(gdf):
+    '''
+    Measures how many bytes the data frame takes. The
+    geometries count as their WKB, which is how they
+    are saved
+    '''
+
+    geometry = gdf.geometry.name
+
+    size = gdf.drop(columns=geometry).memory_usage(index=False, deep=True).sum()
+
+    wkb = shapely.to_wkb(np.asarray(gdf[geometry].values))
+
+    return int(size + sum(len(item) for item in wkb if item is not None))
+
+def report_savings(name, before, after):
+    '''
+    Prints how many bytes pruning the columns saved
+    '''
+
+    saved = before - after
+
+    print(f"{name}: {before:,} -> {after:,} bytes ({saved:,} saved, {saved / max(before, 1):.0%})")
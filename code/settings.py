@@ -0,0 +1,42 @@
+'''
+Settings that can be changed through environment
+variables, without touching the code
+'''
+
+import os
+
+# How many threads clip the tracts crossed by the circle. Zero or one keeps it serial
+CLIP_THREADS = int(os.environ.get("CLIP_THREADS", 0))
+
+# Below this many tracts crossed by the circle, the threads cost more than they save
+CLIP_THREADS_MIN_TRACTS = int(os.environ.get("CLIP_THREADS_MIN_TRACTS", 2000))
+
+# How the query measures the tracts: "numpy" uses the flat edges of the tract store, "geos" decodes the shapes
+COVERAGE = os.environ.get("COVERAGE", "numpy")
+
+# The grid, in degrees, that the tract coordinates are snapped to before splitting. Zero keeps them as they are
+PRECISION_GRID = float(os.environ.get("PRECISION_GRID", 1e-6))
+
+# How much, in degrees, the tract outlines may be simplified, keeping shared borders shared. Needs Shapely 2.1, which the Docker image can't install, so the default of zero keeps them as they are
+SIMPLIFY_TOLERANCE = float(os.environ.get("SIMPLIFY_TOLERANCE", 0))
+
+# How many random circles compare the simplified tracts to the original ones
+SIMPLIFY_SAMPLES = int(os.environ.get("SIMPLIFY_SAMPLES", 200))
+
+# How many bytes of decoded quadrants each worker keeps in memory. Zero turns the cache off
+QUADRANT_CACHE_BYTES = int(os.environ.get("QUADRANT_CACHE_BYTES", 256 * 1024 ** 2))
+
+# Loads the tracts of the whole country once, before gunicorn forks the workers (run it with --preload)
+PRELOAD = bool(int(os.environ.get("PRELOAD", 0)))
+
+# How far, in degrees, the outlines used to find the city of the user are simplified
+CITY_SIMPLIFY_TOLERANCE = float(os.environ.get("CITY_SIMPLIFY_TOLERANCE", 1e-3))
+
+# How many query results each worker keeps. Zero turns the cache off
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 10000))
+
+# The size, in degrees, of the cells that the coordinates are snapped to before looking up a result
+RESULT_CACHE_PRECISION = float(os.environ.get("RESULT_CACHE_PRECISION", 1e-3))
+
+# For how many seconds a result is kept
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", 3600))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+In this script, we make the census tract outlines lighter
+before they are split in quadrants. The coordinates are
+snapped to a grid, dropping digits that no radius needs, and
+the outlines are simplified as a coverage: a border shared
+by two tracts is simplified once, so that no gaps or overlaps
+open up between them. Since every later step works vertex by
+vertex, fewer vertices make all of them cheaper. We then
+measure how much the population of random circles changes
+'''
+
+from coverage import measure_distances, make_population_counter, pack_nodes, ring_edges, tract_rings
+from shapely.geometry import Point
+import numpy as np
+import shapely, warnings
+
+###############
+### HELPERS ###
+###############
+
+def flatten(geometries, population):
+    '''
+    Builds the flat arrays used by coverage.py for a
+    whole set of tracts
+    '''
+
+    geometries = np.asarray(geometries, dtype=object)
+
+    edges, offsets = ring_edges(tract_rings(geometries))
+
+    bounds = shapely.bounds(geometries)
+
+    node_offsets, node_bounds = pack_nodes(bounds)
+
+    area = shapely.area(geometries)
+
+    return {
+
+        "edges": edges,
+        "offsets": offsets,
+        "population": np.where(area > 0, np.nan_to_num(population), 0),
+        "area": area,
+        "bounds": np.nan_to_num(bounds),
+        "node_offsets": node_offsets,
+        "node_bounds": np.nan_to_num(node_bounds)
+
+    }
+
+def count_vertices(geometries):
+
+    return int(shapely.get_num_coordinates(np.asarray(geometries, dtype=object)).sum())
+
+###############
+### PREPARE ###
+###############
+
+def reduce_geometries(geometries, grid_size, tolerance):
+    '''
+    Snaps the coordinates to a grid of the given size and
+    simplifies the outlines. Since neighboring tracts snap
+    their shared vertices to the same place, the borders
+    stay shared. Simplifying each tract on its own would
+    open gaps and overlaps between neighbors, so Shapely
+    versions without coverage simplification (before 2.1)
+    only snap the coordinates
+    '''
+
+    geometries = np.asarray(geometries, dtype=object).copy()
+
+    if grid_size > 0:
+
+        geometries = shapely.set_precision(geometries, grid_size)
+
+    if tolerance > 0:
+
+        # Only polygons can be part of a coverage
+        polygonal = np.isin(shapely.get_type_id(geometries), [ 3, 6 ]) & ~shapely.is_empty(geometries)
+
+        if hasattr(shapely, "coverage_simplify"):
+
+            geometries[polygonal] = shapely.coverage_simplify(geometries[polygonal], tolerance)
+
+        else:
+
+            # Not a UserWarning, which the query scripts imported by prepare.py ignore
+            warnings.warn(f"Shapely {shapely.__version__} can't simplify a coverage, so the outlines were not simplified. SIMPLIFY_TOLERANCE needs Shapely 2.1 or later", RuntimeWarning)
+
+    return geometries
+
+def report_error(original, reduced, population, samples, seed=0):
+    '''
+    Draws circles around points where people live and
+    compares how many people the original and the reduced
+    tracts put inside of them. Prints how many vertices
+    were dropped and the relative error of the counts
+    '''
+
+    population = np.nan_to_num(np.asarray(population, dtype=float))
+
+    before, after = flatten(original, population), flatten(reduced, population)
+
+    rng = np.random.default_rng(seed)
+
+    # The users are where the people are
+    tracts = rng.choice(len(population), size=samples, p=population / population.sum())
+
+    centers = shapely.point_on_surface(np.asarray(original, dtype=object)[tracts])
+
+    # From a neighborhood to a whole region, in degrees
+    radiuses = np.exp(rng.uniform(np.log(.005), np.log(2), size=samples))
+
+    errors = [ ]
+
+    for center, radius in zip(centers, radiuses):
+
+        point = Point(center.x, center.y)
+
+        expected = make_population_counter(point, before, measure_distances(point, before))(radius)
+
+        found = make_population_counter(point, after, measure_distances(point, after))(radius)
+
+        errors.append(abs(found - expected) / max(expected, 1))
+
+    print(f"Vertices: {count_vertices(original):,} -> {count_vertices(reduced):,}")
+
+    print(f"Population error on {samples} circles: mean {np.mean(errors):.4%}, max {np.max(errors):.4%}")
+
+    return errors
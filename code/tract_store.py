@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+In this script, we keep the tracts of every quadrant in a
+single Arrow IPC file, with one record batch per quadrant.
+The file is memory mapped when it's opened, so reading the
+tracts of a quadrant only slices buffers that are already
+mapped, with no file to open. The outlines are kept as
+nested lists: each tract is a list of polygons, each
+polygon a list of rings and each ring a list of x and y
+coordinates. Arrow stores such lists as one flat buffer of
+coordinates plus int32 offsets for each level, which is all
+that coverage.py needs, and Shapely objects are only built
+for the callers that ask for them
+'''
+
+from coverage import join_tract_edges, pack_nodes, ring_edges, tract_rings
+from schema import frame_bytes
+import geopandas as gpd
+import numpy as np
+import pyarrow as pa
+import os, shapely
+
+# The columns saved for each tract, besides its geometry. Everything else from the census is dropped
+COLUMNS = [ "POP_INTER", "area", "minx", "miny", "maxx", "maxy", "circle_x", "circle_y", "circle_radius" ]
+
+# The population of a single tract is a small whole number. The shapes keep their full precision
+TYPES = { column: pa.float32() if column == "POP_INTER" else pa.float64() for column in COLUMNS }
+
+SCHEMA = pa.schema([ (column, TYPES[column]) for column in COLUMNS ] + [
+
+    # Polygons, rings and then x0, y0, x1, y1... for each tract
+    ("geometry", pa.list_(pa.list_(pa.list_(pa.float64()))))
+
+])
+
+###############
+### PREPARE ###
+###############
+
+def open_store_writer(fpath):
+    '''
+    Starts a new store, where each call to write_quadrant
+    adds the record batch of another quadrant. It's written
+    to a temporary file next to the old store, which is only
+    replaced when the new one is closed
+    '''
+
+    sink = pa.OSFile(fpath + ".tmp", "wb")
+
+    return {
+
+        "fpath": fpath,
+        "sink": sink,
+        "writer": pa.ipc.new_file(sink, SCHEMA),
+        "batches": 0,
+        "input_bytes": 0,
+        "stored_bytes": 0
+
+    }
+
+def write_quadrant(store, matches):
+    '''
+    Writes the tracts of a quadrant, which must have an
+    area, and returns the number of their record batch
+    '''
+
+    rings = tract_rings(matches.geometry.values)
+
+    def nest(offsets, values):
+
+        return pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), values)
+
+    # Each coordinate takes two values of the flat buffer
+    geometry = nest(rings["tract_offsets"], nest(rings["part_offsets"], nest(rings["ring_offsets"] * 2, pa.array(rings["coords"].ravel()))))
+
+    arrays = [ pa.array(np.nan_to_num(matches[column].values.astype(float)).astype(TYPES[column].to_pandas_dtype())) for column in COLUMNS ]
+
+    batch = pa.RecordBatch.from_arrays(arrays + [ geometry ], schema=SCHEMA)
+
+    store["writer"].write_batch(batch)
+
+    store["batches"] += 1
+
+    # Compares the clipped tracts, with every column of the census, to what was stored
+    store["input_bytes"] += frame_bytes(matches)
+
+    store["stored_bytes"] += sum(buffer.size for column in batch.columns for buffer in column.buffers() if buffer is not None)
+
+    return store["batches"] - 1
+
+def close_store_writer(store):
+    '''
+    Finishes the new store and puts it in place of the
+    old one. The workers still have the old file mapped,
+    so it must not be truncated: renaming over it keeps
+    their mappings on the old file until they reopen it
+    '''
+
+    store["writer"].close()
+
+    store["sink"].close()
+
+    os.replace(store["fpath"] + ".tmp", store["fpath"])
+
+def discard_store_writer(store):
+    '''
+    Drops a store that failed halfway,
+    leaving the old one in place
+    '''
+
+    store["sink"].close()
+
+    os.remove(store["fpath"] + ".tmp")
+
+###############
+### QUERIES ###
+###############
+
+def open_tract_store(fpath):
+    '''
+    Memory maps the store. Its footer tells
+    where each record batch starts
+    '''
+
+    return pa.ipc.open_file(pa.memory_map(fpath))
+
+def read_rings(batch):
+    '''
+    Reads the coordinates of the tracts and the offsets
+    of each level, with no copies
+    '''
+
+    tracts = batch.column(SCHEMA.get_field_index("geometry"))
+
+    # The batches are never sliced, so the offsets of each level start at zero
+    polygons = tracts.flatten()
+
+    rings = polygons.flatten()
+
+    return {
+
+        "coords": rings.flatten().to_numpy().reshape(-1, 2),
+        "ring_offsets": np.asarray(rings.offsets) // 2,
+        "part_offsets": np.asarray(polygons.offsets),
+        "tract_offsets": np.asarray(tracts.offsets)
+
+    }
+
+def read_tract_arrays(store, batch):
+    '''
+    Reads the tracts of a quadrant as the flat arrays
+    used by coverage.py. The coordinates and the
+    population point straight into the mapped file
+    '''
+
+    batch = store.get_batch(batch)
+
+    def column(name):
+
+        return batch.column(SCHEMA.get_field_index(name))
+
+    edges, offsets = ring_edges(read_rings(batch))
+
+    bounds = np.column_stack([ column(name).to_numpy() for name in ("minx", "miny", "maxx", "maxy") ])
+
+    node_offsets, node_bounds = pack_nodes(bounds)
+
+    return {
+
+        "edges": edges,
+        "offsets": offsets,
+        # Sums of many tracts need the precision of float64
+        "population": column("POP_INTER").to_numpy().astype(float),
+        "area": column("area").to_numpy(),
+        "bounds": bounds,
+        "node_offsets": node_offsets,
+        "node_bounds": node_bounds
+
+    }
+
+def read_tract_frame(store, batch):
+    '''
+    Reads the tracts of a quadrant as a GeoDataFrame,
+    for the GEOS path in radius.py. Only then are
+    Shapely objects built
+    '''
+
+    batch = store.get_batch(batch)
+
+    data = { name: batch.column(SCHEMA.get_field_index(name)).to_numpy().astype(float) for name in COLUMNS }
+
+    rings = read_rings(batch)
+
+    offsets = (rings["ring_offsets"], rings["part_offsets"], rings["tract_offsets"])
+
+    geometry = shapely.from_ragged_array(shapely.GeometryType.MULTIPOLYGON, rings["coords"], offsets)
+
+    return gpd.GeoDataFrame(data, geometry=geometry)
+
+def read_national_arrays(fpath):
+    '''
+    Reads the tracts of every quadrant and joins them in
+    a single set of flat arrays, along with where the
+    tracts and the nodes of each quadrant start. Being a
+    few large NumPy buffers instead of many small objects,
+    they stay shared between the gunicorn workers forked
+    after the loading
+    '''
+
+    store = open_tract_store(fpath)
+
+    parts = [ read_tract_arrays(store, batch) for batch in range(store.num_record_batches) ]
+
+    tracts = join_tract_edges(parts)
+
+    tracts["tract_starts"] = np.concatenate([ [0], np.cumsum([ len(part["population"]) for part in parts ]) ]).astype(int)
+
+    tracts["node_starts"] = np.concatenate([ [0], np.cumsum([ len(part["node_bounds"]) for part in parts ]) ]).astype(int)
+
+    return tracts
+
+def slice_quadrant(national, batch):
+    '''
+    Returns the tracts of a quadrant as views of the
+    arrays read by read_national_arrays. Only the
+    offsets are copied, to start from zero again
+    '''
+
+    first, last = national["tract_starts"][batch], national["tract_starts"][batch + 1]
+
+    first_node, last_node = national["node_starts"][batch], national["node_starts"][batch + 1]
+
+    offsets = national["offsets"][first:last + 1]
+
+    return {
+
+        "edges": national["edges"][offsets[0]:offsets[-1]],
+        "offsets": offsets - offsets[0],
+        "population": national["population"][first:last],
+        "area": national["area"][first:last],
+        "bounds": national["bounds"][first:last],
+        "node_offsets": national["node_offsets"][first_node:last_node + 1] - first,
+        "node_bounds": national["node_bounds"][first_node:last_node]
+
+    }
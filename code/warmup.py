@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Loads the reference data before the first request, so that
+no user waits for the files to be read. With PRELOAD, this
+happens in the gunicorn master, before it forks the workers:
+the data is then shared by all of them, and a worker that is
+restarted gets it for free. Otherwise, each worker loads it
+in the background as soon as it starts, trying again until
+the files can be read
+'''
+
+import gc, threading, time
+import registry, settings
+
+state = { "ready": False, "error": None, "attempts": 0 }
+
+# How many seconds to wait before the first retry, doubling after each failure up to the maximum
+RETRY_DELAY = 1
+
+MAX_RETRY_DELAY = 60
+
+def warm_up():
+    '''
+    Reads every artifact used by the queries into the
+    registry and flags the worker as ready. Returns
+    whether it succeeded
+    '''
+
+    state["attempts"] += 1
+
+    try:
+
+        registry.tract_index()
+        registry.tract_lookup()
+        registry.tract_quadtree()
+        registry.tract_store()
+
+        if settings.PRELOAD and settings.COVERAGE == "numpy":
+
+            registry.tract_arrays()
+
+        registry.city_lookup()
+        registry.city_locator()
+        registry.city_info()
+        registry.vanishing_cities()
+        registry.capitals_radius()
+        registry.case_count()
+
+        # Keeps the garbage collector from touching, and so copying, the objects shared with the workers
+        if settings.PRELOAD:
+
+            gc.freeze()
+
+        state["ready"], state["error"] = True, None
+
+    except Exception as error:
+
+        state["error"] = repr(error)
+
+    return state["ready"]
+
+def keep_warming_up():
+    '''
+    Warms up until it succeeds, waiting longer after each
+    failure, as the files may still be being prepared
+    '''
+
+    delay = RETRY_DELAY
+
+    while not warm_up():
+
+        time.sleep(delay)
+
+        delay = min(delay * 2, MAX_RETRY_DELAY)
+
+def start():
+    '''
+    Warms up right away when preloading, and in a
+    background thread otherwise. A master that can't
+    load the data stops gunicorn, so that the supervisor
+    restarts it, instead of forking workers that would
+    never be ready
+    '''
+
+    if settings.PRELOAD:
+
+        if not warm_up():
+            raise RuntimeError(f"ERRO FATAL: não foi possível carregar os dados de referência: {state['error']}")
+
+    else:
+
+        threading.Thread(target=keep_warming_up, daemon=True).start()